@@ -8,6 +8,7 @@ import tests
 
 import os
 import time
+import shutil
 
 import zim.fs
 from zim.fs import *
@@ -85,6 +86,7 @@ class TestFS(tests.TestCase):
 		self.assertEqual(FilePath('file:///foo/bar'), FilePath('/foo/bar'))
 		self.assertEqual(FilePath('file:/foo/bar'), FilePath('/foo/bar'))
 		self.assertEqual(FilePath('file://localhost/foo/bar'), FilePath('/foo/bar'))
+		self.assertRaises(ValueError, FilePath, 'file://host/foo/bar')
 		self.assertEqual(FilePath('file:///C:/foo/bar'), FilePath('/C:/foo/bar'))
 		if os.name == 'nt':
 			self.assertEqual(FilePath('file:///C:/foo/bar'), FilePath(r'C:\foo\bar'))
@@ -166,6 +168,25 @@ class TestFS(tests.TestCase):
 		file.writelines(['c\n', 'd\n'])
 		self.assertEqual(file.readlines(), ['c\n', 'd\n'])
 
+		# test stat cache
+		file = File(tmpdir + '/stat.txt')
+		file.refresh()
+		self.assertFalse(file.exists())
+		open(file.path, 'w').write('test 123')
+		self.assertFalse(file.exists()) # cached
+		self.assertRaises(OSError, file.mtime)
+		file.invalidate()
+		self.assertTrue(file.exists())
+		file.refresh()
+		self.assertEqual(file.size(), 8)
+		file.write('test')
+		self.assertEqual(file.size(), 4) # write invalidates
+
+		file = File(tmpdir + '/nul\x00.txt')
+		self.assertFalse(file.exists())
+		self.assertFalse(file.isdir())
+		self.assertFalse(Dir(tmpdir + '/nul\x00').exists())
+
 		# test read-only
 		path = tmpdir + '/read-only-file.txt'
 		open(path, 'w').write('test 123')
@@ -179,6 +200,22 @@ class TestFS(tests.TestCase):
 		file.write('Some lines\r\nWith win32 newlines\r\n')
 		file = File(tmpdir + '/newlines.txt')
 		self.assertEqual(file.read(), 'Some lines\nWith win32 newlines\n')
+		file = File(tmpdir + '/dos.txt', endofline='dos')
+		file.write('Some lines\nWith win32 newlines\n')
+		self.assertEqual(file.raw(), b'Some lines\r\nWith win32 newlines\r\n')
+		self.assertEqual(file.read(), 'Some lines\nWith win32 newlines\n')
+
+		# binary content
+		file = File(tmpdir + '/binary.dat')
+		file.write_binary(b'\x00\xff\r\n')
+		self.assertEqual(file.raw(), b'\x00\xff\r\n')
+
+		# content larger than the read chunk size
+		data = b'x' * (zim.fs._READ_CHUNK_SIZE * 3 + 7)
+		file = File(tmpdir + '/large.dat')
+		file.write_binary(data)
+		self.assertEqual(file.raw(), data)
+		self.assertEqual(file.read(), data.decode('UTF-8'))
 
 		# test encoding error
 		non_utf8_file = File('tests/data/non-utf8.txt')
@@ -200,6 +237,10 @@ class TestFS(tests.TestCase):
 		self.assertFalse(file1.compare(file2))
 		file2.copyto(file1)
 		self.assertTrue(file1.compare(file2))
+		if hasattr(os, 'symlink') and os.name != 'nt':
+			os.symlink(file1.path, tmpdir + '/link.txt')
+			self.assertRaises(shutil.SameFileError, file1.copyto, File(tmpdir + '/link.txt'))
+			self.assertEqual(file1.read(), 'foo\nbar\nbaz\n') # not truncated
 
 		# rename is being used when testing Dir
 
@@ -221,7 +262,12 @@ class TestFS(tests.TestCase):
 		dir = get_tmpdir()
 		file = TmpFile('foo.txt')
 		self.assertTrue(file.ischild(dir))
-		# What else to test here ?
+		file.write('test 123\n')
+		self.assertEqual(file.read(), 'test 123\n')
+		inode = os.stat(file.path).st_ino
+		file.write('test 456\n')
+		self.assertEqual(file.read(), 'test 456\n')
+		self.assertEqual(os.stat(file.path).st_ino, inode) # written in place, not replaced
 
 	def testDir(self):
 		'''Test Dir object'''
@@ -250,9 +296,17 @@ class TestFS(tests.TestCase):
 		self.assertEqual(dir.list(), ['foo', 'unique001.txt'])
 		self.assertEqual(dir.subdir('foo').list(), ['bar.txt'])
 
+		entries = dir.list_entries()
+		self.assertEqual([e.name for e in entries], ['foo', 'unique001.txt'])
+		self.assertEqual([e.is_dir() for e in entries], [True, False])
+		stats = dir.list_with_stat()
+		self.assertEqual(sorted(stats.keys()), ['foo', 'unique001.txt'])
+		self.assertEqual(stats['unique001.txt'].st_size, 0)
+
 		fdir = FilteredDir(dir)
 		fdir.ignore('*.txt')
 		self.assertEqual(fdir.list(), ['foo'])
+		self.assertEqual([e.name for e in fdir.list_entries()], ['foo'])
 
 		self.assertEqual(File((dir, 'foo.txt')), dir.file('foo.txt'))
 		self.assertEqual(dir.file(File((dir, 'foo.txt'))), dir.file('foo.txt'))
@@ -281,7 +335,9 @@ class TestFS(tests.TestCase):
 		self.assertTrue(dir.exists())
 		dir.remove()
 		self.assertFalse(dir.exists())
+		dir.remove_children() # non-existing dir is ignored
 		self.assertEqual(dir.list(), []) # list non-existing dir
+		self.assertEqual(dir.list_entries(), [])
 
 	# TODO skip if no gio available
 	# TODO slow test
@@ -785,6 +785,11 @@ class TestLocalFS(tests.TestCase, TestFS):
 
 		self.assertEqual(file.read(), 'test 123\n') # No truncated on error
 
+		with AtomicWriteContext(file, sync=False) as fh:
+			fh.write('test 456\n')
+
+		self.assertEqual(file.read(), 'test 456\n')
+
 	def testImageFile(self):
 		file = self.get_package_data('zim.png')
 		self.assertTrue(file.isimage())
@@ -19,7 +19,9 @@ import re
 import sys
 import shutil
 import tempfile
+import stat
 import errno
+import hashlib
 import logging
 
 
@@ -200,6 +202,97 @@ def lrmdir(path):
 			raise
 
 
+def _remove_children(path):
+	# Recursively remove everything below path, used by Dir.remove_children()
+	# The file type from the scandir entry is used to decide between
+	# unlink and recursing, so no additional stat call per entry is needed.
+	# Symlinks are never followed, unlink removes the link rather than
+	# the target of the link
+	# Like os.walk() errors while listing a folder are ignored, so a
+	# folder that does not exist is treated as empty. Errors while
+	# removing are raised.
+	dirs = []
+	try:
+		it = os.scandir(path)
+	except OSError:
+		return
+
+	with it:
+		for entry in it:
+			if entry.is_dir(follow_symlinks=False):
+				dirs.append(entry.path)
+			else:
+				os.unlink(entry.path)
+
+	for dir in dirs:
+		_remove_children(dir) # recurs
+		os.rmdir(dir)
+
+
+# Copy file content in the kernel where possible, so the data does not
+# pass through user space. copy_file_range() can also share blocks on
+# file systems that support it (e.g. btrfs, xfs). On linux sendfile()
+# works between regular files as well. Other platforms use shutil.
+if hasattr(os, 'copy_file_range'):
+	_kernel_copy = lambda infd, outfd, count: os.copy_file_range(infd, outfd, count)
+elif hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+	_kernel_copy = lambda infd, outfd, count: os.sendfile(outfd, infd, None, count)
+else:
+	_kernel_copy = None
+
+_COPY_CHUNK_SIZE = 1 << 30
+
+
+def _samefile(src, dst):
+	# Like the check in shutil.copyfile(), compares stat results so also
+	# catches symlinks, hard links and case-insensitive file systems
+	try:
+		return os.path.samefile(src, dst)
+	except OSError:
+		return False
+
+
+def _copyfile(src, dst):
+	# Like shutil.copyfile() but using _kernel_copy when available
+	if _samefile(src, dst):
+		# Opening dst for writing would truncate src
+		raise shutil.SameFileError('%r and %r are the same file' % (src, dst))
+
+	if _kernel_copy is None:
+		shutil.copyfile(src, dst)
+		return
+
+	with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+		infd, outfd = fsrc.fileno(), fdst.fileno()
+		copied = 0
+		fallback = False
+		try:
+			while True:
+				n = _kernel_copy(infd, outfd, _COPY_CHUNK_SIZE)
+				if n == 0:
+					# Some file system and kernel combinations report 0 bytes
+					# copied for a file that is not empty
+					fallback = copied == 0 and os.fstat(infd).st_size > 0
+					break
+				copied += n
+		except OSError as e:
+			# Not supported for these files, e.g. across file systems on
+			# older kernels, fall back to a normal copy
+			if copied == 0 and e.errno in (
+				errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+				errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF,
+			):
+				fallback = True
+			else:
+				raise
+
+		if fallback:
+			fsrc.seek(0)
+			fdst.seek(0)
+			fdst.truncate()
+			shutil.copyfileobj(fsrc, fdst)
+
+
 def cleanup_filename(name):
 	'''Removes all characters in 'name' that are not allowed as part
 	of a file name. This function is intended for e.g. config files etc.
@@ -240,9 +333,23 @@ def format_file_size(bytes):
 
 
 
-def _md5(content):
-	import hashlib
-	m = hashlib.md5()
+_HASH_CHUNK_SIZE = 65536
+
+_READ_CHUNK_SIZE = 65536 # read size after the first read sized by fstat
+
+_O_BINARY = getattr(os, 'O_BINARY', 0) # windows only
+
+# For large files hint the kernel to read ahead and to drop the pages
+# from the cache once read. Not used for small files like pages, where
+# the extra calls cost more than they save and the cache is useful.
+_posix_fadvise = getattr(os, 'posix_fadvise', None) # posix only
+_FADVISE_MIN_SIZE = 1 << 20
+
+
+def _digest(content):
+	# Hash used to detect changes in file content, blake2b is both
+	# faster and a better hash than md5
+	m = hashlib.blake2b(digest_size=16)
 	if isinstance(content, str):
 		m.update(content.encode('UTF-8'))
 	else:
@@ -251,6 +358,19 @@ def _md5(content):
 	return m.digest()
 
 
+def _digest_file(path):
+	# Like _digest() but reads the file in chunks instead of loading the
+	# whole content in memory. Reads in text mode, so the result is the
+	# same as _digest() for the content returned by File.read()
+	m = hashlib.blake2b(digest_size=16)
+	with open(path, encoding='UTF-8') as fh:
+		chunk = fh.read(_HASH_CHUNK_SIZE)
+		while chunk:
+			m.update(chunk.encode('UTF-8'))
+			chunk = fh.read(_HASH_CHUNK_SIZE)
+	return m.digest()
+
+
 class PathLookupError(Error):
 	'''Error raised when there is an error finding the specified path'''
 	pass # TODO description
@@ -307,6 +427,16 @@ class FSSingletonClass(SignalEmitter):
 FS = FSSingletonClass()
 
 
+# Prefixes for UnixPath._parse_uri() with the offset of the path, order
+# matters because "file:/" also matches the other forms
+_FILE_URI_PREFIXES = (
+	('file:///', 7),
+	('file://localhost/', 16),
+	('file://', None), # non-local uri
+	('file:/', 5),
+)
+
+
 class UnixPath(object):
 	'''Base class for Dir and File objects, represents a file path
 
@@ -324,6 +454,9 @@ class UnixPath(object):
 	this platform
 	'''
 
+	# Zim can create many of these objects, so avoid a __dict__ per object
+	__slots__ = ('path', '_serialized', '_stat', '_parts')
+
 	def __init__(self, path):
 		'''Constructor
 
@@ -335,13 +468,21 @@ class UnixPath(object):
 		logger.warning('Using deprecated class "zim.fs.%s" - please update your code to use the "zim.newfs" module instead' % self.__class__.__name__)
 
 		self._serialized = None
+		self._stat = None
+		self._parts = None
 
 		if isinstance(path, FilePath):
 			self.path = path.path
 			return
 
 		try:
-			if isinstance(path, (list, tuple)):
+			if type(path) is tuple and len(path) == 2:
+				# Fast path for the common (dir, name) case used by e.g.
+				# Dir.file() and Dir.subdir()
+				a, b = path
+				path = (a.path if isinstance(a, FilePath) else str(a)) \
+					+ SEP + (b.path if isinstance(b, FilePath) else str(b))
+			elif isinstance(path, (list, tuple)):
 				path = list(map(str, path))
 					# Flatten objects - strings should be unicode or ascii already
 				path = SEP.join(path)
@@ -377,17 +518,13 @@ class UnixPath(object):
 		# Spec is file:/// or file://host/
 		# But file:/ is sometimes used by non-compliant apps
 		# Windows uses file:///C:/ which is compliant
-		if uri.startswith('file:///'):
-			uri = uri[7:]
-		elif uri.startswith('file://localhost/'):
-			uri = uri[16:]
-		elif uri.startswith('file://'):
-			assert False, 'Can not handle non-local file uris'
-		elif uri.startswith('file:/'):
-			uri = uri[5:]
+		for prefix, i in _FILE_URI_PREFIXES:
+			if uri.startswith(prefix):
+				if i is None:
+					raise ValueError('Can not handle non-local file uris: %s' % uri)
+				return url_decode(uri[i:])
 		else:
-			assert False, 'Not a file uri: %s' % uri
-		return url_decode(uri)
+			raise ValueError('Not a file uri: %s' % uri)
 
 	def _set_path(self, path):
 		self.path = os.path.abspath(path)
@@ -434,9 +571,11 @@ class UnixPath(object):
 	@property
 	def user_path(self):
 		'''User_path property'''
-		dir = Dir('~') # FIXME: Should we cache this folder somewhere ?
-		if self.ischild(dir):
-			return '~/' + self.relpath(dir)
+		# Use the plain path of the home folder instead of constructing a
+		# Dir object, HOME is not cached since it can change at runtime
+		home = os.path.abspath(_os_expanduser('~'))
+		if self.path.startswith(home + SEP):
+			return '~/' + self.path[len(home):].lstrip(SEP).replace(SEP, '/')
 		else:
 			return None
 
@@ -455,42 +594,80 @@ class UnixPath(object):
 		'''Creates a L{FSObjectMonitor} for this path'''
 		return FSObjectMonitor(self)
 
+	def refresh(self):
+		'''Cache the C{stat()} result for this path. As long as the
+		cache is set, methods like L{exists()}, L{mtime()} and L{size()}
+		re-use it instead of calling C{os.stat()} each time. Use this
+		when calling several of these methods in a row, and call
+		L{invalidate()} afterwards.
+		'''
+		try:
+			self._stat = os.stat(self.path)
+		except OSError:
+			self._stat = False # cache non-existence as well
+
+	def invalidate(self):
+		'''Drop the cached C{stat()} result set by L{refresh()}'''
+		self._stat = None
+
+	def _get_stat(self):
+		# Returns the cached stat result if available, raises OSError
+		# when the path does not exist
+		if self._stat is None:
+			return os.stat(self.path)
+		elif self._stat is False:
+			raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), self.path)
+		else:
+			return self._stat
+
+	def _get_mode(self):
+		# Like os.path.exists() also catch ValueError, e.g. for a path with
+		# an embedded NUL character
+		try:
+			return self._get_stat().st_mode
+		except (OSError, ValueError):
+			return None
+
 	def exists(self):
 		'''Check if a file or folder exists.
 		@returns: C{True} if the file or folder exists
 		@implementation: must be implemented by sub classes in order
 		that they enforce the type of the resource as well
 		'''
-		return os.path.exists(self.path)
+		return self._get_mode() is not None
 
 	def iswritable(self):
 		'''Check if a file or folder is writable. Uses permissions of
 		parent folder if the file or folder does not (yet) exist.
 		@returns: C{True} if the file or folder is writable
 		'''
-		if self.exists():
-			return os.access(self.path, os.W_OK)
-		else:
-			return self.dir.iswritable() # recurs
+		# Walk up using plain paths instead of constructing Dir objects
+		path = self.path if self.exists() else os.path.dirname(self.path)
+		while not os.path.exists(path):
+			parent = os.path.dirname(path)
+			if parent == path:
+				break # root, e.g. non-existing drive on windows
+			path = parent
+		return os.access(path, os.W_OK)
 
 	def mtime(self):
 		'''Get the modification time of the file path.
 		@returns: the mtime timestamp
 		'''
-		return os.stat(self.path).st_mtime
+		return self._get_stat().st_mtime
 
 	def ctime(self):
 		'''Get the creation time of the file path.
 		@returns: the mtime timestamp
 		'''
-		return os.stat(self.path).st_ctime
+		return self._get_stat().st_ctime
 
 	def size(self):
 		'''Get file size in bytes
 		See L{format_file_size()} to get a human readable label
 		@returns: file size in bytes
 		'''
-		return os.stat(self.path).st_size
+		return self._get_stat().st_size
 
 	def isequal(self, other):
 		'''Check file paths are equal based on stat results (inode
@@ -519,10 +696,13 @@ class UnixPath(object):
 		path elements will not be robust for the path "/".)
 		@returns: a list of path elements
 		'''
-		drive, path = os.path.splitdrive(self.path)
-		parts = path.replace('\\', '/').strip('/').split('/')
-		parts[0] = drive + SEP + parts[0]
-		return parts
+		if self._parts is None:
+			# path does not change, so cache the result
+			drive, path = os.path.splitdrive(self.path)
+			parts = path.replace('\\', '/').strip('/').split('/')
+			parts[0] = drive + SEP + parts[0]
+			self._parts = tuple(parts)
+		return list(self._parts)
 
 	def relpath(self, reference, allowupward=False):
 		'''Get a relative path for this file path with respect to
@@ -575,14 +755,19 @@ class UnixPath(object):
 		'''Check if this path is a child path of a folder
 		@returns: C{True} if this path is a child path of C{parent}
 		'''
-		return self.path.startswith(parent.path + SEP)
+		# Same as startswith(parent.path + SEP) without a new string
+		i = len(parent.path)
+		return len(self.path) > i \
+			and self.path[i] == SEP \
+			and self.path.startswith(parent.path)
 
 	def isdir(self):
 		'''Check if this path is a folder or not. Used to detect if
 		e.g. a L{File} object should have really been a L{Dir} object.
 		@returns: C{True} when this path is a folder
 		'''
-		return os.path.isdir(self.path)
+		mode = self._get_mode()
+		return mode is not None and stat.S_ISDIR(mode)
 
 	def rename(self, newpath):
 		'''Rename (move) the content this file or folder to another
@@ -615,6 +800,8 @@ class UnixPath(object):
 			newpath.dir.touch()
 			shutil.move(self.path, newpath.path)
 
+		self.invalidate()
+		newpath.invalidate()
 		FS.emit('path-moved', self, newpath)
 		self.dir.cleanup()
 
@@ -624,6 +811,8 @@ class WindowsPath(UnixPath):
 	on windows.
 	'''
 
+	__slots__ = ()
+
 	def _set_path(self, path):
 		# Strip leading / for absolute paths
 		if re.match(r'^[/\\]+[A-Za-z]:[/\\]', path):
@@ -655,6 +844,8 @@ else:
 class Dir(FilePath):
 	'''Class representing a single file system folder'''
 
+	__slots__ = ()
+
 	def __eq__(self, other):
 		if isinstance(other, Dir):
 			return self.path == other.path
@@ -662,7 +853,8 @@ class Dir(FilePath):
 			return False
 
 	def exists(self):
-		return os.path.isdir(self.path)
+		mode = self._get_mode()
+		return mode is not None and stat.S_ISDIR(mode)
 
 	def list(self, glob=None, includehidden=False, includetmp=False, raw=False):
 		'''List the file contents
@@ -680,7 +872,7 @@ class Dir(FilePath):
 		will throw warnings if those are encountered.
 		Hidden files are silently ignored.
 		'''
-		files = self._list(includehidden, includetmp)
+		files = [entry.name for entry in self._list_entries(includehidden, includetmp)]
 
 		if glob:
 			expr = _glob_to_regex(glob)
@@ -689,19 +881,73 @@ class Dir(FilePath):
 		files.sort()
 		return files
 
-	def _list(self, includehidden, includetmp):
-		if self.exists():
-			files = []
-			for file in os.listdir(self.path):
-				if file.startswith('.') and not includehidden:
-					continue # skip hidden files
-				elif (file.endswith('~') or file.startswith('~')) and not includetmp:
-					continue # skip temporary files
-				else:
-					files.append(file)
-			return files
-		else:
-			return []
+	def list_entries(self, glob=None, includehidden=False, includetmp=False, raw=False):
+		'''List the file contents as C{os.DirEntry} objects
+
+		Like L{list()} but returns the entries from C{os.scandir()}.
+		These cache the file type as reported by the directory listing,
+		so e.g. C{entry.is_dir()} does not need an additional C{stat()}
+		call per entry.
+
+		@param glob: a file name glob to filter the listed files, e.g C{"*.png"}
+		@param includehidden: if C{True} include hidden files
+		@param includetmp: if C{True} include temporary files
+		@param raw: for filtered folders disable filtering
+
+		@returns: a list of C{os.DirEntry} objects sorted by name
+		'''
+		entries = self._list_entries(includehidden, includetmp)
+
+		if glob:
+			expr = _glob_to_regex(glob)
+			entries = [e for e in entries if expr.match(e.name)]
+
+		entries.sort(key=lambda e: e.name)
+		return entries
+
+	def list_with_stat(self, glob=None, includehidden=False, includetmp=False, raw=False):
+		'''List the file contents together with their C{stat()} results
+
+		Uses the entries from L{list_entries()}, on windows the stat
+		result is already part of the directory listing, on other
+		platforms it is cached per entry after the first call.
+
+		@param glob: a file name glob to filter the listed files, e.g C{"*.png"}
+		@param includehidden: if C{True} include hidden files
+		@param includetmp: if C{True} include temporary files
+		@param raw: for filtered folders disable filtering
+
+		@returns: a dict mapping names to C{os.stat_result} objects,
+		names that can not be stat-ed (e.g. broken symlinks) are skipped
+		'''
+		stats = {}
+		for entry in self.list_entries(glob, includehidden, includetmp, raw):
+			try:
+				stats[entry.name] = entry.stat()
+			except OSError:
+				pass # removed in between, or broken symlink
+		return stats
+
+	def _list_entries(self, includehidden, includetmp):
+		try:
+			with os.scandir(self.path) as it:
+				entries = []
+				for entry in it:
+					# Names are str already because self.path is str, and
+					# never empty, so just compare characters
+					first, last = entry.name[0], entry.name[-1]
+					if first == '.' and not includehidden:
+						continue # skip hidden files
+					elif (last == '~' or first == '~') and not includetmp:
+						continue # skip temporary files
+					else:
+						entries.append(entry)
+				return entries
+		except OSError as e:
+			if e.errno in (errno.ENOENT, errno.ENOTDIR):
+				return [] # folder does not exist
+			else:
+				raise
 
 	def walk(self, raw=True):
 		'''Generator that yields all files and folders below this dir
@@ -709,15 +955,14 @@ class Dir(FilePath):
 		@param raw: see L{list()}
 		@returns: yields L{File} and L{Dir} objects, depth first
 		'''
-		for name in self.list(raw=raw):
-			path = self.path + SEP + name
-			if os.path.isdir(path):
-				dir = self.subdir(name)
+		for entry in self.list_entries(raw=raw):
+			if entry.is_dir():
+				dir = self.subdir(entry.name)
 				yield dir
 				for child in dir.walk(raw=raw):
 					yield child
 			else:
-				yield self.file(name)
+				yield self.file(entry.name)
 
 	def get_file_tree_as_text(self, raw=True):
 		'''Returns an overview of files and folders below this dir
@@ -738,24 +983,29 @@ class Dir(FilePath):
 		exist.
 		@param mode: creation mode (e.g. 0700)
 		'''
-		if self.exists():
-			# Additional check needed because makedirs can not handle
-			# a path like "E:\" on windows (while "E:\foo" works fine)
-			return
-
+		self.invalidate()
 		try:
-			if mode is not None:
-				os.makedirs(self.path, mode=mode)
-			else:
-				os.makedirs(self.path)
+			st = os.stat(self.path)
 		except OSError as e:
-			if e.errno != errno.EEXIST:
+			if e.errno != errno.ENOENT:
 				raise
+		else:
+			if stat.S_ISDIR(st.st_mode):
+				# Additional check needed because makedirs can not handle
+				# a path like "E:\" on windows (while "E:\foo" works fine)
+				return
+
+		# exist_ok still raises if the path exists but is not a folder
+		if mode is not None:
+			os.makedirs(self.path, mode=mode, exist_ok=True)
+		else:
+			os.makedirs(self.path, exist_ok=True)
 
 	def remove(self):
 		'''Remove this folder, fails if it is not empty.'''
 		logger.info('Remove dir: %s', self)
 		lrmdir(self.path)
+		self.invalidate()
 		FS.emit('path-deleted', self)
 
 	def cleanup(self):
@@ -772,6 +1022,7 @@ class Dir(FilePath):
 		except OSError:
 			return False # probably dir not empty
 		else:
+			self.invalidate()
 			return True
 
 	def remove_children(self):
@@ -783,14 +1034,7 @@ class Dir(FilePath):
 		'''
 		assert self.path and self.path != '/'
 		logger.info('Remove file tree: %s', self)
-		for root, dirs, files in os.walk(self.path, topdown=False):
-			# walk should not decent into symlinked folders by default
-			# remove() and rmdir() both should remove a symlink rather
-			# than the target of the link
-			for name in files:
-				os.remove(os.path.join(root, name))
-			for name in dirs:
-				lrmdir(os.path.join(root, name))
+		_remove_children(self.path)
 
 	def copyto(self, dest):
 		'''Recursively copy the contents of this folder.
@@ -807,13 +1051,11 @@ class Dir(FilePath):
 
 		def copy_dir(source, target):
 			target.touch()
-			for item in source.list():
-				child = FilePath((source, item))
-				if child.isdir():
-					copy_dir(Dir(child), target.subdir(item)) # recur
+			for entry in source.list_entries():
+				if entry.is_dir():
+					copy_dir(source.subdir(entry.name), target.subdir(entry.name)) # recur
 				else:
-					child = File(child)
-					child.copyto(target)
+					source.file(entry.name).copyto(target)
 
 		copy_dir(self, dest)
 		# TODO - not hooked with FS signals
@@ -957,6 +1199,8 @@ class FilteredDir(Dir):
 	control.
 	'''
 
+	__slots__ = ('_ignore',)
+
 	def __init__(self, path):
 		'''Constructor
 
@@ -988,6 +1232,12 @@ class FilteredDir(Dir):
 			files = list(filter(self.filter, files))
 		return files
 
+	def list_entries(self, glob=None, includehidden=False, includetmp=False, raw=False):
+		entries = Dir.list_entries(self, glob, includehidden, includetmp)
+		if not raw:
+			entries = [e for e in entries if self.filter(e.name)]
+		return entries
+
 
 class File(FilePath):
 	'''Class representing a single file.
@@ -1000,8 +1250,8 @@ class File(FilePath):
 
 	Also it implements logic to check the modification time before
 	writing to prevent overwriting a file that was changed on disk in
-	between read and write operations. If this mtime check fails MD5
-	sums are used to verify before raising an exception (because some
+	between read and write operations. If this mtime check fails
+	content hashes are used to verify before raising an exception (because some
 	share drives do not maintain mtime very precisely).
 	This logic is not atomic, so your mileage may vary.
 	'''
@@ -1015,14 +1265,18 @@ class File(FilePath):
 	# If we encounter a left over .zim-new~ we ignore it since it may be
 	# corrupted.
 	#
-	# For Window the behavior is more complicated, see the WindowsFile class
-	# below.
+	# On Windows the same is achieved with "os.replace()" which replaces the
+	# existing file in a single call, see AtomicWriteContext in zim.newfs.local
 	#
 	# Note that the mechanism to avoid overwriting files that changed on disks
 	# does not prevent conflicts when two processes try to write to the same
 	# file at the same time. This is a hard problem that is currently not
 	# addressed in this implementation.
 
+	__slots__ = ('checkoverwrite', 'endofline', '_mtime', '_hash')
+
+	_sync_on_write = True
+
 	def __init__(self, path, checkoverwrite=False, endofline=None):
 		'''Constructor
 
@@ -1043,7 +1297,7 @@ class File(FilePath):
 		self.checkoverwrite = checkoverwrite
 		self.endofline = endofline
 		self._mtime = None
-		self._md5 = None
+		self._hash = None
 
 	def __eq__(self, other):
 		if isinstance(other, File):
@@ -1052,7 +1306,8 @@ class File(FilePath):
 			return False
 
 	def exists(self):
-		return os.path.isfile(self.path)
+		mode = self._get_mode()
+		return mode is not None and stat.S_ISREG(mode)
 
 	def isimage(self):
 		'''Check if this is an image file. Convenience method that
@@ -1115,13 +1370,35 @@ class File(FilePath):
 		@returns: file content as string
 		'''
 		try:
-			fh = open(self.path, mode='rb')
-			content = fh.read()
-			fh.close()
-			return content
+			return self._read_bytes()
 		except IOError:
 			raise FileNotFoundError(self)
 
+	def _read_bytes(self):
+		# Read using a file descriptor directly, the size from fstat allows
+		# reading the whole file in a single call without the buffering
+		# of a file object. Keep reading till EOF in case the file grew,
+		# but in small chunks, a second read of the full size would
+		# allocate another buffer as large as the file.
+		fd = os.open(self.path, os.O_RDONLY | _O_BINARY)
+		try:
+			size = os.fstat(fd).st_size
+			fadvise = _posix_fadvise and size >= _FADVISE_MIN_SIZE
+			if fadvise:
+				_posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+			chunks = []
+			chunk = os.read(fd, max(size, _READ_CHUNK_SIZE))
+			while chunk:
+				chunks.append(chunk)
+				chunk = os.read(fd, _READ_CHUNK_SIZE)
+
+			if fadvise:
+				_posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+			return b''.join(chunks)
+		finally:
+			os.close(fd)
+
 	def read(self):
 		'''Get the file contents as a string. Takes case of decoding
 		UTF-8 and fixes line endings.
@@ -1142,8 +1419,12 @@ class File(FilePath):
 		return text
 
 	def _read(self):
-		with open(self.path, encoding='UTF-8') as fh:
-			return fh.read()
+		# Decode the whole file at once instead of using a file object in
+		# text mode, then do the same newline translation as it would do
+		text = self._read_bytes().decode('UTF-8')
+		if '\r' in text:
+			text = text.replace('\r\n', '\n').replace('\r', '\n')
+		return text
 
 	def readlines(self):
 		'''Get the file contents as a list of lines. Takes case of
@@ -1153,8 +1434,8 @@ class File(FilePath):
 		@raises FileNotFoundError: when the file does not exist.
 		'''
 		try:
-			file = open(self.path, encoding='UTF-8')
-			lines = file.readlines()
+			with open(self.path, encoding='UTF-8') as fh:
+				lines = fh.readlines()
 			self._checkoverwrite(lines)
 			return [line.lstrip('\ufeff').replace('\x00', '') for line in lines]
 				# Strip unicode byte order mark
@@ -1166,6 +1447,18 @@ class File(FilePath):
 
 		return lines
 
+	def _write_prepare(self):
+		# Checks before writing, these all need stat results for this
+		# file, so cache them for the duration of the checks
+		self.refresh()
+		try:
+			self._assertoverwrite()
+			isnew = not self.exists()
+			self._write_check()
+		finally:
+			self.invalidate()
+		return isnew
+
 	def _write_check(self):
 		if not self.iswritable():
 			raise FileWriteError(_('File is not writable: %s') % self.path) # T: Error message
@@ -1183,13 +1476,8 @@ class File(FilePath):
 		@param text: new content as (unicode) string
 		@emits: path-created if the file did not yet exist
 		'''
-		self._assertoverwrite()
-		isnew = not os.path.isfile(self.path)
-		newline = self.get_endofline()
-		self._write_check()
-		with AtomicWriteContext(self, newline=newline) as fh:
-			fh.write(text)
-
+		isnew = self._write_prepare()
+		self._write_data(self._encode(text))
 		self._checkoverwrite(text)
 		if isnew:
 			FS.emit('path-created', self)
@@ -1200,34 +1488,56 @@ class File(FilePath):
 		@param lines: new content as list of lines
 		@emits: path-created if the file did not yet exist
 		'''
-		self._assertoverwrite()
-		isnew = not os.path.isfile(self.path)
-		newline = self.get_endofline()
-		self._write_check()
-		with AtomicWriteContext(self, newline=newline) as fh:
-			fh.writelines(lines)
-
+		isnew = self._write_prepare()
+		self._write_data(self._encode(''.join(lines)))
 		self._checkoverwrite(lines)
 		if isnew:
 			FS.emit('path-created', self)
 
+	def write_binary(self, data):
+		'''Write raw file content without UTF-8 encoding, newline logic,
+		etc. Like L{write()} this is an atomic write. Note that this
+		function does not maintain the mtime check, so a following
+		L{write()} will not detect changes on disk.
+		@param data: new content as C{bytes}
+		@emits: path-created if the file did not yet exist
+		'''
+		isnew = self._write_prepare()
+		self._write_data(data)
+		self._mtime = None
+		self._hash = None
+		if isnew:
+			FS.emit('path-created', self)
+
+	def _encode(self, text):
+		# Encode once and write as binary, this avoids the text layer of
+		# the file object. Same replace for newlines as it would do.
+		newline = self.get_endofline()
+		if newline != '\n':
+			text = text.replace('\n', newline)
+		return text.encode('UTF-8')
+
+	def _write_data(self, data):
+		with AtomicWriteContext(self, sync=self._sync_on_write, mode='wb') as fh:
+			fh.write(data)
+
 	def _checkoverwrite(self, content):
 		# Set properties needed by assertoverwrite for the in-memory object
 		if self.checkoverwrite:
 			self._mtime = self.mtime()
-			self._md5 = _md5(content)
+			self._hash = _digest(content)
 
 	def _assertoverwrite(self):
 		# When we read a file and than write it, this method asserts the file
 		# did not change in between (e.g. by another process, or another async
 		# function of our own process). We use properties of this object instance
-		# We check the timestamp, if that does not match we check md5 to be sure.
+		# We check the timestamp, if that does not match we check a hash of the content to be sure.
 		# (Sometimes e.g. network filesystems do not maintain timestamps as strict
 		# as we would like.)
 		#
 		# This function should not prohibit writing without reading first.
 		# Also we just write the file if it went missing in between
-		if self._mtime and self._md5:
+		if self._mtime and self._hash:
 			try:
 				mtime = self.mtime()
 			except OSError:
@@ -1238,15 +1548,14 @@ class File(FilePath):
 					raise
 
 			if not self._mtime == mtime:
-				logger.warning('mtime check failed for %s, trying md5', self.path)
-				if self._md5 != _md5(self._read()):
+				logger.warning('mtime check failed for %s, trying hash', self.path)
+				if self._hash != _digest_file(self.path):
 					raise FileWriteError(_('File changed on disk: %s') % self.path)
 						# T: error message
-					# Why are we using MD5 here ?? could just compare content...
 
 	def check_has_changed_on_disk(self):
 		'''Returns C{True} when this file has changed on disk'''
-		if not (self._mtime and self._md5):
+		if not (self._mtime and self._hash):
 			if os.path.isfile(self.path):
 				return True # may well been just created
 			else:
@@ -1285,6 +1594,7 @@ class File(FilePath):
 		if os.path.isfile(tmp):
 			os.remove(tmp)
 
+		self.invalidate()
 		FS.emit('path-deleted', self)
 
 	def cleanup(self):
@@ -1296,7 +1606,7 @@ class File(FilePath):
 
 	def copyto(self, dest):
 		'''Copy this file to another location. Preserves all file
-		attributes (by using C{shutil.copy2()})
+		attributes (like C{shutil.copy2()})
 		@param dest: a L{File} or L{Dir} object for the destination. If the
 		destination is a folder, we will copy to a file below that
 		folder of the same name
@@ -1310,9 +1620,13 @@ class File(FilePath):
 		logger.info('Copy %s to %s', self, dest)
 		if isinstance(dest, Dir):
 			dest.touch()
+			path = dest.path + SEP + self.basename
 		else:
 			dest.dir.touch()
-		shutil.copy2(self.path, dest.path)
+			path = dest.path
+		_copyfile(self.path, path)
+		shutil.copystat(self.path, path)
+		dest.invalidate()
 		# TODO - not hooked with FS signals
 
 	def compare(self, other):
@@ -1322,8 +1636,7 @@ class File(FilePath):
 		@returns: C{True} when the files have the same content
 		'''
 		# TODO: can be more efficient, e.g. by checking stat size first
-		# also wonder if MD5 is needed here ... could just compare text
-		return _md5(self.read()) == _md5(other.read())
+		return _digest(self.read()) == _digest(other.read())
 
 
 class TmpFile(File):
@@ -1331,6 +1644,8 @@ class TmpFile(File):
 	and by default they are deleted again when the object is destructed.
 	'''
 
+	__slots__ = ('persistent',)
+
 	def __init__(self, basename, unique=True, persistent=False):
 		'''Constructor
 
@@ -1353,34 +1668,11 @@ class TmpFile(File):
 		if not self.persistent:
 			self.remove()
 
-
-
-# Replace logic based on discussion here:
-# http://stupidpythonideas.blogspot.nl/2014/07/getting-atomic-writes-right.html
-#
-# The point is to get a function to replace an old file with a new
-# file as "atomic" as possible
-
-if hasattr(os, 'replace'):
-	_replace_file = os.replace
-elif sys.platform == 'win32':
-	# The win32api.MoveFileEx method somehow does not like our unicode,
-	# the ctypes version does ??!
-	import ctypes
-	_MoveFileEx = ctypes.windll.kernel32.MoveFileExW
-	_MoveFileEx.argtypes = [ctypes.c_wchar_p, ctypes.c_wchar_p, ctypes.c_uint32]
-	_MoveFileEx.restype = ctypes.c_bool
-	def _replace_file(src, dst):
-		try:
-			if not _MoveFileEx(src, dst, 1): # MOVEFILE_REPLACE_EXISTING
-				raise OSError('Could not replace "%s" -> "%s"' % (src, dst))
-		except:
-			# Sometimes it fails - we play stupid and try again...
-			time.sleep(0.5)
-			if not _MoveFileEx(src, dst, 1): # MOVEFILE_REPLACE_EXISTING
-				raise OSError('Could not replace "%s" -> "%s"' % (src, dst))
-else:
-	_replace_file = os.rename
+	def _write_data(self, data):
+		# Scratch data, so no need for an atomic write or to sync to disk,
+		# just write directly
+		with open(self.path, 'wb') as fh:
+			fh.write(data)
 
 
 ### TODO filter Dir.list directly for hidden files
@@ -5,9 +5,7 @@
 
 
 
-import sys
 import os
-import time
 import shutil
 import tempfile
 import errno
@@ -241,28 +239,17 @@ class LocalFolder(LocalFSObjectBase, Folder):
 # http://stupidpythonideas.blogspot.nl/2014/07/getting-atomic-writes-right.html
 #
 # The point is to get a function to replace an old file with a new
-# file as "atomic" as possible
-
-if hasattr(os, 'replace'):
-	_replace_file = os.replace
-elif sys.platform == 'win32':
-	# The win32api.MoveFileEx method somehow does not like our unicode,
-	# the ctypes version does ??!
-	import ctypes
-	_MoveFileEx = ctypes.windll.kernel32.MoveFileExW
-	_MoveFileEx.argtypes = [ctypes.c_wchar_p, ctypes.c_wchar_p, ctypes.c_uint32]
-	_MoveFileEx.restype = ctypes.c_bool
-	def _replace_file(src, dst):
-		try:
-			if not _MoveFileEx(src, dst, 1): # MOVEFILE_REPLACE_EXISTING
-				raise OSError('Could not replace "%s" -> "%s"' % (src, dst))
-		except:
-			# Sometimes it fails - we play stupid and try again...
-			time.sleep(0.5)
-			if not _MoveFileEx(src, dst, 1): # MOVEFILE_REPLACE_EXISTING
-				raise OSError('Could not replace "%s" -> "%s"' % (src, dst))
-else:
-	_replace_file = os.rename
+# file as "atomic" as possible. On python 3 "os.replace()" does this on
+# all platforms in a single call (using "MoveFileEx" with
+# MOVEFILE_REPLACE_EXISTING on windows), so no fallback is needed.
+
+_replace_file = os.replace
+
+
+# fdatasync() only flushes the metadata needed to read back the data,
+# not e.g. the mtime, which saves a journal commit on most file systems.
+# Not available on all platforms, so fall back to fsync()
+_sync_file = getattr(os, 'fdatasync', os.fsync)
 
 
 class AtomicWriteContext(object):
@@ -270,10 +257,13 @@ class AtomicWriteContext(object):
 	# used by LocalFile.write and .writelines
 	# Exposed as separate object to make it testable.
 	# Should not be needed outside this module
+	# Set "sync" to False to skip syncing the data to disk, only intended
+	# for scratch files where durability does not matter
 
-	def __init__(self, path, **kwargs):
+	def __init__(self, path, sync=True, **kwargs):
 		self.path = path if isinstance(path, str) else path.path
 		self.tmppath = self.path + '.zim-new~'
+		self.sync = sync
 		self.kwargs = kwargs
 		self.kwargs.setdefault('mode', 'w')
 		if 'b' not in self.kwargs['mode']:
@@ -297,8 +287,13 @@ class AtomicWriteContext(object):
 
 	def __exit__(self, *exc_info):
 		# flush to ensure write is done
+		# Note that the sync must complete before the replace below, else a
+		# crash could leave an empty file in place of the old content. So it
+		# can not be deferred and batched over multiple files without also
+		# deferring the replace.
 		self.fh.flush()
-		os.fsync(self.fh.fileno())
+		if self.sync:
+			_sync_file(self.fh.fileno())
 		self.fh.close()
 
 		if not any(exc_info) and os.path.isfile(self.tmppath):
@@ -315,6 +310,8 @@ class AtomicWriteContext(object):
 
 class LocalFile(LocalFSObjectBase, File):
 
+	_sync_on_write = True
+
 	def __init__(self, path, endofline=_EOL, watcher=None):
 		LocalFSObjectBase.__init__(self, path, watcher=watcher)
 		self._mimetype = None
@@ -386,18 +383,18 @@ class LocalFile(LocalFSObjectBase, File):
 	def write(self, text):
 		newline = '\r\n' if self.endofline == 'dos' else '\n'
 		with self._write_decoration():
-			with AtomicWriteContext(self, newline=newline) as fh:
+			with AtomicWriteContext(self, sync=self._sync_on_write, newline=newline) as fh:
 				fh.write(text)
 
 	def writelines(self, lines):
 		newline = '\r\n' if self.endofline == 'dos' else '\n'
 		with self._write_decoration():
-			with AtomicWriteContext(self, newline=newline) as fh:
+			with AtomicWriteContext(self, sync=self._sync_on_write, newline=newline) as fh:
 				fh.writelines(lines)
 
 	def write_binary(self, data):
 		with self._write_decoration():
-			with AtomicWriteContext(self, mode='wb') as fh:
+			with AtomicWriteContext(self, sync=self._sync_on_write, mode='wb') as fh:
 				fh.write(data)
 
 	def touch(self):
@@ -471,6 +468,8 @@ class TmpFile(LocalFile):
 	and by default they are deleted again when the object is destructed.
 	'''
 
+	_sync_on_write = False # scratch data, no need to wait for the disk
+
 	def __init__(self, basename, unique=True, persistent=False):
 		'''Constructor
 		@param basename: gives the name for this tmp file.